@@ -0,0 +1,64 @@
+# Cython declarations augmenting parser.py; only used when it is compiled.
+#
+# The AST dataclasses stay Python classes (dataclass(slots=True) replaces the
+# class it decorates, which an extension type can't be); the parser and the
+# lark tree builder, which run once per tree node, become extension types with
+# C-level method calls and typed source positions. The builder's _build picks
+# its handler by comparing rule names, so those calls stay at C level too.
+
+cimport cython
+
+
+cdef class ConfigurikBuilder:
+    cdef readonly str text
+
+    cpdef object build(self, object tree)
+    cdef object _build(self, object node)
+    cdef object _filler(self, Py_ssize_t start, Py_ssize_t end)
+
+    @cython.locals(entries=list, rest=list, last=Py_ssize_t)
+    cdef object _items(
+        self,
+        list children,
+        Py_ssize_t start,
+        Py_ssize_t end,
+        type items_cls,
+        type content_cls,
+        type element_cls,
+    )
+
+    cpdef object _discriminator(self, object node)
+    cpdef object _list_closure(self, object node)
+    cpdef object _record_closure(self, object node)
+    cpdef object _kv(self, object node)
+    cpdef object _string(self, object tok)
+    cpdef object _number(self, object tok)
+
+
+cdef class ConfigurikParser:
+    cdef readonly str text
+
+    cpdef object parse(self)
+    cdef Py_ssize_t _skip(self, Py_ssize_t pos)
+
+    @cython.locals(
+        text=str,
+        entries=list,
+        rest=list,
+        c=str,
+        pos=Py_ssize_t,
+        comma=Py_ssize_t,
+    )
+    cdef object _items(self, Py_ssize_t start, str close, bint records)
+
+    @cython.locals(text=str, c=str)
+    cdef object _entity(self, Py_ssize_t pos)
+
+    @cython.locals(text=str, name=str, after=Py_ssize_t)
+    cdef object _discriminator(self, Py_ssize_t pos, Py_ssize_t name_end)
+
+    cdef object _list_closure(self, Py_ssize_t pos)
+    cdef object _record_closure(self, Py_ssize_t pos)
+
+    @cython.locals(text=str, key_end=Py_ssize_t, colon=Py_ssize_t, value=Py_ssize_t)
+    cdef object _kv(self, Py_ssize_t pos)
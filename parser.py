@@ -1,31 +1,36 @@
-from dataclasses import dataclass
-from typing import List, Tuple, Union
-from lark import Lark, Transformer, Token, v_args
+import functools
+import gc
+import re
+import string
+import sys
+import weakref
+from dataclasses import dataclass, field
+from typing import Iterable, List, Tuple, Union
+from lark import Lark, Token, Tree
+from lark.exceptions import UnexpectedCharacters, UnexpectedInput
+from lark.lexer import Lexer
 
-# TODO: try to parse with lalrl
 # TODO: uint, int
 
-grammar = r"""    
+grammar = r"""
     start: record_items
 
-    discriminator: CNAME (filler1 entity)?
+    discriminator: CNAME entity?
 
     list_closure: "[" list_items "]"
-    list_items: [filler list_content] filler ["," filler]
-    list_content: entity list_element*
-    list_element: filler "," filler entity
+    list_items: _list_content? ","?
+    _list_content: _list_content "," entity
+                 | entity
 
     record_closure: "{" record_items "}"
-    record_items: [filler record_content] filler ["," filler]
-    record_content: kv record_element*
-    record_element: filler "," filler kv
-    kv: CNAME filler ":" filler entity
+    record_items: _record_content? ","?
+    _record_content: _record_content "," kv
+                   | kv
+    kv: CNAME ":" entity
 
-    SPACING: /[ \t\r\n]+/
-    ML_COMMENT: "/*" /(.|\n)*?/ "*/"
-    SL_COMMENT: "//" /[^\n]*/
-    filler: (SPACING | ML_COMMENT | SL_COMMENT)*
-    filler1: (SPACING | ML_COMMENT | SL_COMMENT)+
+    // A whole run of spacing and comments is skipped as one token; fillers
+    // are sliced from the source, see Filler.parts() for the split.
+    TRIVIA: /(?:[ \t\r\n]++|\/\*.*?\*\/|\/\/[^\n]*+)+/s
 
     ?entity: ESCAPED_STRING
            | SIGNED_NUMBER
@@ -33,196 +38,364 @@ grammar = r"""
            | list_closure
            | discriminator
 
+    // Same languages as common.ESCAPED_STRING / common.SIGNED_NUMBER, written
+    // with possessive quantifiers so the lexer never backtracks into them.
+    ESCAPED_STRING: /"(?:[^"\\\n]++|\\.)*+"/
+    SIGNED_NUMBER: /[+-]?(?:[0-9]++(?:\.[0-9]*+)?|\.[0-9]++)(?:[eE][+-]?[0-9]++)?/
+
     %import common.CNAME
-    %import common.ESCAPED_STRING
-    %import common.SIGNED_NUMBER
+
+    %ignore TRIVIA
 """
 
+# Trivia is ignored by the LALR grammar; fillers are sliced from the source
+# text between the positions of adjacent tokens and split on demand.
+_TRIVIA_RE = re.compile(
+    r"(?P<SPACING>[ \t\r\n]+)|/\*(?P<ML_COMMENT>.*?)\*/|//(?P<SL_COMMENT>[^\n]*)",
+    re.DOTALL,
+)
+
 # --- AST dataclasses ---
 
 
-@dataclass
-class Spacing:
-    text: str
+class Node:
+    """Base of AST nodes; restore() renders the node back to source text.
+
+    Node subclasses are dataclasses, so walkers can dispatch on type(node)
+    with a dict, or with class patterns in a match statement (positional
+    patterns follow field order), instead of isinstance chains. Comment is
+    the one abstract class: a type(node) table needs entries for
+    SinglelineComment and MultilineComment, while ``case Comment()`` matches
+    both.
+    """
+
+    __slots__ = ()
+
+    def restore(self) -> str:
+        out: List[str] = []
+        self._restore_into(out)
+        return "".join(out)
+
+    def _restore_into(self, out: List[str]) -> None:
+        raise NotImplementedError
+
+
+def _with_hookless(cls: type) -> type:
+    # Parsers build nodes as cls._hookless, which stores attributes directly,
+    # then switch them to cls: filling in a parsed tree doesn't go through
+    # SourceNode.__setattr__, which only needs to see later edits.
+    cls._hookless = type(
+        cls.__name__, (cls,), {"__slots__": (), "__setattr__": object.__setattr__}
+    )
+    return cls
+
+
+@dataclass(slots=True, weakref_slot=True)
+class SourceNode(Node):
+    """Node that remembers the span of source text it was parsed from.
+
+    While the node is backed by its source, restoring it is a single slice of
+    that text. Assigning a field of a SourceNode invalidates it, so it and its
+    ancestors are rebuilt from their children on the next restore(). Edits
+    inside the plain nodes it holds (a Filler's text, the element lists and
+    elements of ListContent/RecordContent) aren't seen: call invalidate() on
+    the SourceNode holding them. restore() keeps the rebuilt text until the
+    next invalidation when every rebuilt node came from a parse; a tree
+    holding nodes built by hand is rebuilt on each call.
+    """
+
+    start_pos: int | None = field(default=None, kw_only=True, repr=False, compare=False)
+    end_pos: int | None = field(default=None, kw_only=True, repr=False, compare=False)
+    _src: str | None = field(default=None, kw_only=True, repr=False, compare=False)
+    # weak, so that a parsed tree holds no reference cycles and is freed by
+    # refcounting alone
+    _parent: "weakref.ref[SourceNode] | None" = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _cached: str | None = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name: str, value) -> None:
+        object.__setattr__(self, name, value)
+        if name[0] != "_" and name != "start_pos" and name != "end_pos":
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        node = self
+        while node is not None:
+            node._src = None
+            node._cached = None
+            parent = node._parent
+            node = parent() if parent is not None else None
 
     def restore(self) -> str:
-        return self.text
+        if self._src is not None:
+            return self._src[self.start_pos : self.end_pos]
+        if self._cached is not None:
+            return self._cached
+        text = Node.restore(self)
+        if self._adopt():
+            self._cached = text
+        return text
+
+    def _adopt(self) -> bool:
+        # Link the rebuilt part of the subtree to the nodes now holding it,
+        # so that invalidate() on a node attached after the parse reaches
+        # this one; true if all of it came from a parse and may be cached
+        parent = weakref.ref(self)
+        parsed = self.start_pos is not None
+        for child in self._children():
+            child._parent = parent
+            if child._src is None and child._cached is None:
+                parsed = child._adopt() and parsed
+        return parsed
+
+    def _children(self) -> "Iterable[SourceNode]":
+        return ()
+
+    def _restore_into(self, out: List[str]) -> None:
+        if self._src is not None:
+            out.append(self._src[self.start_pos : self.end_pos])
+        elif self._cached is not None:
+            out.append(self._cached)
+        else:
+            self._build_into(out)
+
+    def _build_into(self, out: List[str]) -> None:
+        raise NotImplementedError
 
 
-@dataclass
-class Comment:
+@dataclass(slots=True)
+class Spacing(Node):
     text: str
 
-    def restore(self) -> str:
+    def _restore_into(self, out: List[str]) -> None:
+        out.append(self.text)
+
+
+@dataclass(slots=True)
+class Comment(Node):
+    text: str
+
+    def _restore_into(self, out: List[str]) -> None:
         raise NotImplementedError("Use subclass restore method")
 
 
-@dataclass
+@dataclass(slots=True)
 class SinglelineComment(Comment):
-    def restore(self) -> str:
-        return "//" + self.text
+    def _restore_into(self, out: List[str]) -> None:
+        out.append("//")
+        out.append(self.text)
 
 
-@dataclass
+@dataclass(slots=True)
 class MultilineComment(Comment):
-    def restore(self) -> str:
-        return "/*" + self.text + "*/"
+    def _restore_into(self, out: List[str]) -> None:
+        out.append("/*")
+        out.append(self.text)
+        out.append("*/")
 
 
-@dataclass
-class Filler:
-    data: List[Union[Spacing, Comment]]
+@dataclass(slots=True)
+class Filler(Node):
+    text: str
 
-    def restore(self) -> str:
-        return "".join(e.restore() for e in self.data)
+    def parts(self) -> List[Union[Spacing, Comment]]:
+        return [
+            _TRIVIA_CLASSES[m.lastgroup](m.group(m.lastgroup))
+            for m in _TRIVIA_RE.finditer(self.text)
+        ]
+
+    def _restore_into(self, out: List[str]) -> None:
+        out.append(self.text)
 
 
-@dataclass
-class StringEntity:
+@_with_hookless
+@dataclass(slots=True)
+class StringEntity(SourceNode):
     raw: str
 
-    def restore(self) -> str:
-        return '"' + self.raw + '"'
+    def _build_into(self, out: List[str]) -> None:
+        out.append('"')
+        out.append(self.raw)
+        out.append('"')
 
 
-@dataclass
-class NumberEntity:
+@_with_hookless
+@dataclass(slots=True)
+class NumberEntity(SourceNode):
     raw: str
 
-    def restore(self) -> str:
-        return self.raw
+    @property
+    def value(self) -> int | float:
+        # SIGNED_NUMBER only admits a float through a point or an exponent
+        raw = self.raw
+        if "." in raw or "e" in raw or "E" in raw:
+            return float(raw)
+        return int(raw)
+
+    def _build_into(self, out: List[str]) -> None:
+        out.append(self.raw)
 
 
-@dataclass
-class DiscriminatorEntity:
+@_with_hookless
+@dataclass(slots=True)
+class DiscriminatorEntity(SourceNode):
     name: str
     data: Tuple[Filler, "Entity"] | None
 
-    def restore(self) -> str:
-        if self.data is None:
-            return self.name
-        else:
+    def _build_into(self, out: List[str]) -> None:
+        out.append(self.name)
+        if self.data is not None:
             filler, ent = self.data
-            return self.name + filler.restore() + ent.restore()
+            filler._restore_into(out)
+            ent._restore_into(out)
 
+    def _children(self) -> Iterable[SourceNode]:
+        if self.data is not None:
+            yield self.data[1]
 
-@dataclass
-class ListElement:
+
+@dataclass(slots=True)
+class ListElement(Node):
     precomma_filler: Filler
     postcomma_filler: Filler
     entity: "Entity"
 
-    def restore(self) -> str:
-        return (
-            self.precomma_filler.restore()
-            + ","
-            + self.postcomma_filler.restore()
-            + self.entity.restore()
-        )
+    def _restore_into(self, out: List[str]) -> None:
+        self.precomma_filler._restore_into(out)
+        out.append(",")
+        self.postcomma_filler._restore_into(out)
+        self.entity._restore_into(out)
 
 
-@dataclass
-class ListContent:
+@dataclass(slots=True)
+class ListContent(Node):
     first_element: "Entity"
     rest_elements: List[ListElement]
 
-    def restore(self) -> str:
-        return self.first_element.restore() + "".join(
-            e.restore() for e in self.rest_elements
-        )
+    def _restore_into(self, out: List[str]) -> None:
+        self.first_element._restore_into(out)
+        for e in self.rest_elements:
+            e._restore_into(out)
 
 
-@dataclass
-class ListItems:
+@_with_hookless
+@dataclass(slots=True)
+class ListItems(SourceNode):
     content: Tuple[Filler, ListContent] | None
     filler: Filler
     after_trailing: Filler | None
 
-    def restore(self) -> str:
-        return (
-            (
-                self.content[0].restore() + self.content[1].restore()
-                if self.content
-                else ""
-            )
-            + self.filler.restore()
-            + ("," + self.after_trailing.restore() if self.after_trailing else "")
-        )
-
-
-@dataclass
-class ListClosure:
+    def _build_into(self, out: List[str]) -> None:
+        if self.content:
+            self.content[0]._restore_into(out)
+            self.content[1]._restore_into(out)
+        self.filler._restore_into(out)
+        if self.after_trailing:
+            out.append(",")
+            self.after_trailing._restore_into(out)
+
+    def _children(self) -> Iterable[SourceNode]:
+        if self.content:
+            content = self.content[1]
+            yield content.first_element
+            for e in content.rest_elements:
+                yield e.entity
+
+
+@_with_hookless
+@dataclass(slots=True)
+class ListClosure(SourceNode):
     items: ListItems
 
-    def restore(self) -> str:
-        return "[" + self.items.restore() + "]"
+    def _build_into(self, out: List[str]) -> None:
+        out.append("[")
+        self.items._restore_into(out)
+        out.append("]")
+
+    def _children(self) -> Iterable[SourceNode]:
+        yield self.items
 
 
-@dataclass
-class KVPair:
+@_with_hookless
+@dataclass(slots=True)
+class KVPair(SourceNode):
     key: str
     precolumn_filler: Filler
     postcolumn_filler: Filler
     data: "Entity"
 
-    def restore(self) -> str:
-        return (
-            self.key
-            + self.precolumn_filler.restore()
-            + ":"
-            + self.postcolumn_filler.restore()
-            + self.data.restore()
-        )
+    def _build_into(self, out: List[str]) -> None:
+        out.append(self.key)
+        self.precolumn_filler._restore_into(out)
+        out.append(":")
+        self.postcolumn_filler._restore_into(out)
+        self.data._restore_into(out)
+
+    def _children(self) -> Iterable[SourceNode]:
+        yield self.data
 
 
-@dataclass
-class RecordElement:
+@dataclass(slots=True)
+class RecordElement(Node):
     precomma_filler: Filler
     postcomma_filler: Filler
     kv_pair: KVPair
 
-    def restore(self) -> str:
-        return (
-            self.precomma_filler.restore()
-            + ","
-            + self.postcomma_filler.restore()
-            + self.kv_pair.restore()
-        )
+    def _restore_into(self, out: List[str]) -> None:
+        self.precomma_filler._restore_into(out)
+        out.append(",")
+        self.postcomma_filler._restore_into(out)
+        self.kv_pair._restore_into(out)
 
 
-@dataclass
-class RecordContent:
+@dataclass(slots=True)
+class RecordContent(Node):
     first_pair: KVPair
     rest_pairs: List[RecordElement]
 
-    def restore(self) -> str:
-        return self.first_pair.restore() + "".join(e.restore() for e in self.rest_pairs)
+    def _restore_into(self, out: List[str]) -> None:
+        self.first_pair._restore_into(out)
+        for e in self.rest_pairs:
+            e._restore_into(out)
 
 
-@dataclass
-class RecordItems:
+@_with_hookless
+@dataclass(slots=True)
+class RecordItems(SourceNode):
     content: Tuple[Filler, RecordContent] | None
     filler: Filler
     after_trailing: Filler | None
 
-    def restore(self) -> str:
-        return (
-            (
-                self.content[0].restore() + self.content[1].restore()
-                if self.content
-                else ""
-            )
-            + self.filler.restore()
-            + ("," + self.after_trailing.restore() if self.after_trailing else "")
-        )
-
-
-@dataclass
-class RecordClosure:
+    def _build_into(self, out: List[str]) -> None:
+        if self.content:
+            self.content[0]._restore_into(out)
+            self.content[1]._restore_into(out)
+        self.filler._restore_into(out)
+        if self.after_trailing:
+            out.append(",")
+            self.after_trailing._restore_into(out)
+
+    def _children(self) -> Iterable[SourceNode]:
+        if self.content:
+            content = self.content[1]
+            yield content.first_pair
+            for e in content.rest_pairs:
+                yield e.kv_pair
+
+
+@_with_hookless
+@dataclass(slots=True)
+class RecordClosure(SourceNode):
     items: RecordItems
 
-    def restore(self) -> str:
-        return "{" + self.items.restore() + "}"
+    def _build_into(self, out: List[str]) -> None:
+        out.append("{")
+        self.items._restore_into(out)
+        out.append("}")
+
+    def _children(self) -> Iterable[SourceNode]:
+        yield self.items
 
 
 Entity = Union[
@@ -242,83 +415,547 @@ RootEntity = Union[
 ]
 
 
-class ConfigurikTransformer(Transformer):
-    @v_args(inline=True)
-    def start(self, record_items):
-        return record_items
+_TRIVIA_CLASSES = {
+    "SPACING": Spacing,
+    "ML_COMMENT": MultilineComment,
+    "SL_COMMENT": SinglelineComment,
+}
 
-    def discriminator(self, args):
-        name = args[0]
-        if len(args) == 1:
-            return DiscriminatorEntity(name=name, data=None)
-        else:
-            return DiscriminatorEntity(name=name, data=(args[1], args[2]))
+# Links parsed nodes without going through SourceNode.__setattr__
+_set_parent = SourceNode._parent.__set__
 
-    def list_closure(self, args):
-        return ListClosure(*args)
 
-    def list_items(self, args):
-        return ListItems(
-            content=(args[0], args[1]) if args[1] is not None else None,
-            filler=args[2],
-            after_trailing=args[3],
-        )
+class ConfigurikBuilder:
+    """Builds the AST from a raw lark tree, dispatching on rule/terminal name."""
 
-    def list_content(self, args):
-        return ListContent(args[0], args[1:])
+    def __init__(self, text: str):
+        self.text = text
 
-    def list_element(self, args):
-        return ListElement(*args)
+    def build(self, tree: Tree) -> RecordItems:
+        (record_items,) = tree.children
+        return self._items(
+            record_items.children,
+            0,
+            len(self.text),
+            RecordItems,
+            RecordContent,
+            RecordElement,
+        )
 
-    def record_closure(self, args):
-        return RecordClosure(*args)
+    def _build(self, node: Union[Tree, Token]) -> "Entity | KVPair":
+        # Trees by rule name, tokens (lark or lark_cython) by type. Compiled,
+        # this calls the handlers directly; a table of methods would hold
+        # bound methods (a cycle through self) or Python wrappers of them.
+        if isinstance(node, Tree):
+            rule = node.data
+            if rule == "kv":
+                return self._kv(node)
+            if rule == "record_closure":
+                return self._record_closure(node)
+            if rule == "list_closure":
+                return self._list_closure(node)
+            return self._discriminator(node)
+        if node.type == "ESCAPED_STRING":
+            return self._string(node)
+        return self._number(node)
+
+    def _filler(self, start: int, end: int) -> Filler:
+        return Filler(self.text[start:end])
+
+    def _items(
+        self,
+        children: List[Union[Tree, Token]],
+        start: int,
+        end: int,
+        items_cls: type,
+        content_cls: type,
+        element_cls: type,
+    ) -> Union[ListItems, RecordItems]:
+        # children: entries separated by comma tokens, maybe with a trailing
+        # comma; elements are built in the same pass that walks them
+        entries = []
+        rest = []
+        prev = comma = None
+        for child in children:
+            if getattr(child, "type", None) == "COMMA":
+                comma = child
+                continue
+            entry = self._build(child)
+            if prev is not None:
+                rest.append(
+                    element_cls(
+                        self._filler(prev.end_pos, comma.start_pos),
+                        self._filler(comma.end_pos, entry.start_pos),
+                        entry,
+                    )
+                )
+            entries.append(entry)
+            prev = entry
+            comma = None
+        trailing = comma
+
+        if entries:
+            first = entries[0]
+            content = (self._filler(start, first.start_pos), content_cls(first, rest))
+            last = prev.end_pos
+        else:
+            content = None
+            last = start
 
-    def record_items(self, args):
-        return RecordItems(
-            content=(args[0], args[1]) if args[1] is not None else None,
-            filler=args[2],
-            after_trailing=args[3],
+        if trailing is None:
+            filler = self._filler(last, end)
+            after_trailing = None
+        else:
+            filler = self._filler(last, trailing.start_pos)
+            after_trailing = self._filler(trailing.end_pos, end)
+
+        items = items_cls._hookless(
+            content,
+            filler,
+            after_trailing,
+            start_pos=start,
+            end_pos=end,
+            _src=self.text,
         )
+        items.__class__ = items_cls
+        parent = weakref.ref(items)
+        for entry in entries:
+            _set_parent(entry, parent)
+        return items
+
+    def _discriminator(self, node: Tree) -> DiscriminatorEntity:
+        name = node.children[0]
+        if len(node.children) == 1:
+            disc = DiscriminatorEntity._hookless(
+                name=sys.intern(name.value),
+                data=None,
+                start_pos=name.start_pos,
+                end_pos=name.end_pos,
+                _src=self.text,
+            )
+            disc.__class__ = DiscriminatorEntity
+            return disc
+        else:
+            ent = self._build(node.children[1])
+            disc = DiscriminatorEntity._hookless(
+                name=sys.intern(name.value),
+                data=(self._filler(name.end_pos, ent.start_pos), ent),
+                start_pos=name.start_pos,
+                end_pos=ent.end_pos,
+                _src=self.text,
+            )
+            disc.__class__ = DiscriminatorEntity
+            _set_parent(ent, weakref.ref(disc))
+            return disc
+
+    def _list_closure(self, node: Tree) -> ListClosure:
+        lsqb, list_items, rsqb = node.children
+        items = self._items(
+            list_items.children,
+            lsqb.end_pos,
+            rsqb.start_pos,
+            ListItems,
+            ListContent,
+            ListElement,
+        )
+        closure = ListClosure._hookless(
+            items, start_pos=lsqb.start_pos, end_pos=rsqb.end_pos, _src=self.text
+        )
+        closure.__class__ = ListClosure
+        _set_parent(items, weakref.ref(closure))
+        return closure
+
+    def _record_closure(self, node: Tree) -> RecordClosure:
+        lbrace, record_items, rbrace = node.children
+        items = self._items(
+            record_items.children,
+            lbrace.end_pos,
+            rbrace.start_pos,
+            RecordItems,
+            RecordContent,
+            RecordElement,
+        )
+        closure = RecordClosure._hookless(
+            items, start_pos=lbrace.start_pos, end_pos=rbrace.end_pos, _src=self.text
+        )
+        closure.__class__ = RecordClosure
+        _set_parent(items, weakref.ref(closure))
+        return closure
+
+    def _kv(self, node: Tree) -> KVPair:
+        key, colon, value = node.children
+        ent = self._build(value)
+        pair = KVPair._hookless(
+            sys.intern(key.value),
+            self._filler(key.end_pos, colon.start_pos),
+            self._filler(colon.end_pos, ent.start_pos),
+            ent,
+            start_pos=key.start_pos,
+            end_pos=ent.end_pos,
+            _src=self.text,
+        )
+        pair.__class__ = KVPair
+        _set_parent(ent, weakref.ref(pair))
+        return pair
+
+    def _string(self, tok: Token) -> StringEntity:
+        ent = StringEntity._hookless(
+            tok.value[1:-1],
+            start_pos=tok.start_pos,
+            end_pos=tok.end_pos,
+            _src=self.text,
+        )
+        ent.__class__ = StringEntity
+        return ent
 
-    def record_content(self, args):
-        return RecordContent(args[0], args[1:])
-
-    def record_element(self, args):
-        return RecordElement(*args)
+    def _number(self, tok: Token) -> NumberEntity:
+        ent = NumberEntity._hookless(
+            tok.value, start_pos=tok.start_pos, end_pos=tok.end_pos, _src=self.text
+        )
+        ent.__class__ = NumberEntity
+        return ent
 
-    def kv(self, args):
-        return KVPair(*args)
 
-    def SPACING(self, tok: Token):
-        return Spacing(tok.value)
+# --- hand-written parser ---
 
-    def ML_COMMENT(self, tok: Token):
-        return MultilineComment(tok.value[2:-2])
+# Mirror the grammar's terminals; the LALR parser serves as the reference.
+_STRING_RE = re.compile(r'"(?:[^"\\\n]++|\\.)*+"')
+_NUMBER_RE = re.compile(
+    r"[+-]?(?:[0-9]++(?:\.[0-9]*+)?|\.[0-9]++)(?:[eE][+-]?[0-9]++)?"
+)
+_CNAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*+")
+_SKIP_RE = re.compile(r"(?:[ \t\r\n]++|/\*.*?\*/|//[^\n]*+)*+", re.DOTALL)
 
-    def SL_COMMENT(self, tok: Token):
-        return SinglelineComment(tok.value[2:])
+_ENTITY_START = frozenset('"{[+-.0123456789_' + string.ascii_letters)
 
-    def filler(self, args):
-        return Filler(args)
 
-    def filler1(self, args):
-        return Filler(args)
+class ParseError(UnexpectedInput, ValueError):
+    """Malformed input; an UnexpectedInput like the LALR parser's errors."""
 
-    def CNAME(self, tok: Token):
-        return tok.value
+    def __init__(self, text: str, pos: int, expected: str):
+        self.pos_in_stream = pos
+        self.line = text.count("\n", 0, pos) + 1
+        self.column = pos - text.rfind("\n", 0, pos)
+        if pos < len(text):
+            found = repr(text[pos])
+        else:
+            found = "end of input"
+        super().__init__(
+            f"Unexpected {found} at line {self.line}, column {self.column}; "
+            f"expected {expected}"
+        )
 
-    def ESCAPED_STRING(self, tok: Token):
-        return StringEntity(tok.value[1:-1])
 
-    def SIGNED_NUMBER(self, tok: Token):
-        return NumberEntity(tok.value)
+class ConfigurikParser:
+    """Recursive-descent parser producing the same AST as the LALR grammar.
 
+    The language is LL(1): every entity is recognised by its first character,
+    so the parser scans the source directly with no token stream in between.
+    """
 
-parser = Lark(grammar, parser="earley")
+    def __init__(self, text: str):
+        self.text = text
 
-transformer = ConfigurikTransformer()
+    def parse(self) -> RecordItems:
+        return self._items(0, "", True)
 
+    def _skip(self, pos: int) -> int:
+        return _SKIP_RE.match(self.text, pos).end()
 
-def parse_configurik(text: str):
-    tree = parser.parse(text)
-    return transformer.transform(tree)
+    def _items(
+        self, start: int, close: str, records: bool
+    ) -> Union[ListItems, RecordItems]:
+        # Entries (key/value pairs for records, entities for lists) separated
+        # by commas, maybe with a trailing comma, up to the close character
+        # ("" for the end of input), which is not consumed.
+        text = self.text
+        if records:
+            items_cls, content_cls, element_cls = (
+                RecordItems,
+                RecordContent,
+                RecordElement,
+            )
+        else:
+            items_cls, content_cls, element_cls = ListItems, ListContent, ListElement
+        entries = []
+        pos = self._skip(start)
+        c = text[pos : pos + 1]
+        if c != close and c != ",":
+            prev = self._kv(pos) if records else self._entity(pos)
+            entries.append(prev)
+            rest = []
+            while True:
+                comma = self._skip(prev.end_pos)
+                if text.startswith(",", comma):
+                    pos = self._skip(comma + 1)
+                    if text[pos : pos + 1] != close:
+                        entry = self._kv(pos) if records else self._entity(pos)
+                        rest.append(
+                            element_cls(
+                                Filler(text[prev.end_pos : comma]),
+                                Filler(text[comma + 1 : pos]),
+                                entry,
+                            )
+                        )
+                        entries.append(entry)
+                        prev = entry
+                        continue
+                    filler = Filler(text[prev.end_pos : comma])
+                    after_trailing = Filler(text[comma + 1 : pos])
+                else:
+                    pos = comma
+                    filler = Filler(text[prev.end_pos : pos])
+                    after_trailing = None
+                break
+            first = entries[0]
+            content = (Filler(text[start : first.start_pos]), content_cls(first, rest))
+        else:
+            content = None
+            filler = Filler(text[start:pos])
+            after_trailing = None
+            if c == ",":
+                comma = pos
+                pos = self._skip(comma + 1)
+                after_trailing = Filler(text[comma + 1 : pos])
+
+        if text[pos : pos + 1] != close:
+            raise ParseError(text, pos, repr(close) if close else "end of input")
+
+        items = items_cls._hookless(
+            content,
+            filler,
+            after_trailing,
+            start_pos=start,
+            end_pos=pos,
+            _src=text,
+        )
+        items.__class__ = items_cls
+        parent = weakref.ref(items)
+        for entry in entries:
+            _set_parent(entry, parent)
+        return items
+
+    def _entity(self, pos: int) -> "Entity":
+        text = self.text
+        c = text[pos : pos + 1]
+        if c == '"':
+            m = _STRING_RE.match(text, pos)
+            if m is None:
+                raise ParseError(text, pos, "a string")
+            ent = StringEntity._hookless(
+                text[pos + 1 : m.end() - 1],
+                start_pos=pos,
+                end_pos=m.end(),
+                _src=text,
+            )
+            ent.__class__ = StringEntity
+            return ent
+        if c == "{":
+            return self._record_closure(pos)
+        if c == "[":
+            return self._list_closure(pos)
+        m = _CNAME_RE.match(text, pos)
+        if m is not None:
+            return self._discriminator(pos, m.end())
+        m = _NUMBER_RE.match(text, pos)
+        if m is not None:
+            ent = NumberEntity._hookless(
+                m.group(), start_pos=pos, end_pos=m.end(), _src=text
+            )
+            ent.__class__ = NumberEntity
+            return ent
+        raise ParseError(text, pos, "an entity")
+
+    def _discriminator(self, pos: int, name_end: int) -> DiscriminatorEntity:
+        text = self.text
+        name = sys.intern(text[pos:name_end])
+        after = self._skip(name_end)
+        if text[after : after + 1] not in _ENTITY_START:
+            disc = DiscriminatorEntity._hookless(
+                name=name, data=None, start_pos=pos, end_pos=name_end, _src=text
+            )
+            disc.__class__ = DiscriminatorEntity
+            return disc
+        ent = self._entity(after)
+        disc = DiscriminatorEntity._hookless(
+            name=name,
+            data=(Filler(text[name_end:after]), ent),
+            start_pos=pos,
+            end_pos=ent.end_pos,
+            _src=text,
+        )
+        disc.__class__ = DiscriminatorEntity
+        _set_parent(ent, weakref.ref(disc))
+        return disc
+
+    def _list_closure(self, pos: int) -> ListClosure:
+        items = self._items(pos + 1, "]", False)
+        closure = ListClosure._hookless(
+            items, start_pos=pos, end_pos=items.end_pos + 1, _src=self.text
+        )
+        closure.__class__ = ListClosure
+        _set_parent(items, weakref.ref(closure))
+        return closure
+
+    def _record_closure(self, pos: int) -> RecordClosure:
+        items = self._items(pos + 1, "}", True)
+        closure = RecordClosure._hookless(
+            items, start_pos=pos, end_pos=items.end_pos + 1, _src=self.text
+        )
+        closure.__class__ = RecordClosure
+        _set_parent(items, weakref.ref(closure))
+        return closure
+
+    def _kv(self, pos: int) -> KVPair:
+        text = self.text
+        m = _CNAME_RE.match(text, pos)
+        if m is None:
+            raise ParseError(text, pos, "a key")
+        key_end = m.end()
+        colon = self._skip(key_end)
+        if not text.startswith(":", colon):
+            raise ParseError(text, colon, "':'")
+        value = self._skip(colon + 1)
+        ent = self._entity(value)
+        pair = KVPair._hookless(
+            sys.intern(m.group()),
+            Filler(text[key_end:colon]),
+            Filler(text[colon + 1 : value]),
+            ent,
+            start_pos=pos,
+            end_pos=ent.end_pos,
+            _src=text,
+        )
+        pair.__class__ = KVPair
+        _set_parent(ent, weakref.ref(pair))
+        return pair
+
+
+# --- LALR lexer ---
+
+_PUNCTUATION = {
+    "[": "LSQB",
+    "]": "RSQB",
+    "{": "LBRACE",
+    "}": "RBRACE",
+    ",": "COMMA",
+    ":": "COLON",
+}
+
+# One alternation over every terminal of the grammar, trivia included, so
+# each token costs a single match instead of a scan over the terminal list.
+# Only comments may span lines: DOTALL is scoped to TRIVIA so that a
+# backslash can't escape a newline inside a string.
+_TOKEN_RE = re.compile(
+    "|".join(
+        f"(?P<{name}>{pattern})"
+        for name, pattern in (
+            ("TRIVIA", r"(?s:[ \t\r\n]++|/\*.*?\*/|//[^\n]*+)++"),
+            ("ESCAPED_STRING", _STRING_RE.pattern),
+            ("SIGNED_NUMBER", _NUMBER_RE.pattern),
+            ("CNAME", _CNAME_RE.pattern),
+            ("PUNCTUATION", r"[][{},:]"),
+        )
+    )
+)
+
+
+class ConfigurikLexer(Lexer):
+    """Tokenizes for the LALR grammar with the precompiled ``_TOKEN_RE``."""
+
+    def __init__(self, lexer_conf):
+        pass
+
+    def lex(self, data: str):
+        match = _TOKEN_RE.match
+        line, line_start = 1, 0
+        pos, end = 0, len(data)
+        while pos < end:
+            m = match(data, pos)
+            if m is None:
+                raise UnexpectedCharacters(data, pos, line, pos - line_start + 1)
+            kind = m.lastgroup
+            next_pos = m.end()
+            if kind == "TRIVIA":
+                newlines = data.count("\n", pos, next_pos)
+                if newlines:
+                    line += newlines
+                    line_start = data.rfind("\n", pos, next_pos) + 1
+            else:
+                value = m.group()
+                if kind == "PUNCTUATION":
+                    kind = _PUNCTUATION[value]
+                column = pos - line_start + 1
+                yield Token(
+                    kind,
+                    value,
+                    pos,
+                    line,
+                    column,
+                    line,
+                    column + next_pos - pos,
+                    next_pos,
+                )
+            pos = next_pos
+
+
+@functools.cache
+def _lark_parser(compiled: bool = True) -> Lark:
+    if compiled:
+        try:
+            import lark_cython
+        except ImportError:
+            return _lark_parser(compiled=False)
+        # lark_cython brings a compiled lexer of its own
+        options = {"_plugins": lark_cython.plugins}
+    else:
+        options = {"lexer": ConfigurikLexer}
+    return Lark(grammar, parser="lalr", keep_all_tokens=True, cache=True, **options)
+
+
+def _without_gc(parse):
+    # Parsing allocates a large number of small, long-lived objects; with the
+    # cyclic GC running, each collection re-traverses the growing tree. Weak
+    # parents keep the tree free of cycles, but not the collections from
+    # running: on a 600KB input they still double the parse time.
+    @functools.wraps(parse)
+    def wrapper(text: str) -> RecordItems:
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return parse(text)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    return wrapper
+
+
+@_without_gc
+def parse_configurik(text: str) -> RecordItems:
+    """Parse text into its RecordItems root.
+
+    The cyclic garbage collector is paused for the whole process while the
+    parse runs, and turned back on when it returns if it was on before. A
+    gc.disable() another thread makes in the meantime is undone when the
+    parse returns, so code that runs with the collector off shouldn't parse
+    concurrently with it. parse_configurik_lark does the same.
+    """
+    return ConfigurikParser(text).parse()
+
+
+@_without_gc
+def parse_configurik_lark(text: str) -> RecordItems:
+    """Parse with the LALR grammar; slower, kept as the reference parser."""
+    parser = _lark_parser()
+    try:
+        tree = parser.parse(text)
+    except UnexpectedInput:
+        # No lark_cython release keeps the parser state lark's UnexpectedToken
+        # formats its message from (str() raises AttributeError); re-parse in
+        # pure Python to raise an intact error.
+        fallback = _lark_parser(compiled=False)
+        if fallback is parser:
+            raise
+        tree = fallback.parse(text)
+    return ConfigurikBuilder(text).build(tree)
@@ -0,0 +1,25 @@
+import os
+
+from setuptools import setup
+
+# parser.py is plain Python; when Cython is available it is additionally
+# compiled to an extension module (typed by parser.pxd), which Python imports
+# in preference to the source. The extension is optional, so a failed compile
+# still installs the pure-Python module; CONFIGURKA_NO_CYTHON=1 skips it.
+try:
+    if os.environ.get("CONFIGURKA_NO_CYTHON"):
+        raise ImportError
+    from Cython.Build import cythonize
+except ImportError:
+    ext_modules = []
+else:
+    # types come from parser.pxd; the Python annotations are for readers
+    ext_modules = cythonize(
+        ["parser.py"],
+        language_level=3,
+        compiler_directives={"annotation_typing": False},
+    )
+    for ext in ext_modules:
+        ext.optional = True
+
+setup(py_modules=["parser"], ext_modules=ext_modules)
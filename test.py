@@ -1,8 +1,103 @@
 # --- main: parse file, restore and verify equality ---
 import sys
+from dataclasses import fields, is_dataclass
+
 from lark import UnexpectedInput
 
-from parser import parse_configurik
+from parser import (
+    Filler,
+    NumberEntity,
+    RecordClosure,
+    parse_configurik,
+    parse_configurik_lark,
+)
+
+
+def check_edits(ast, input_data):
+    """Edit the innermost first key/value pair in place and restore."""
+    items, pair = ast, None
+    while items.content is not None:
+        pair = items.content[1].first_pair
+        if not isinstance(pair.data, RecordClosure):
+            break
+        items = pair.data.items
+    if pair is None:
+        return True
+    original = pair.data
+    head = input_data[: original.start_pos]
+    tail = input_data[original.end_pos :]
+
+    def restores_to(expected):
+        # twice, so that a stale cached text would show
+        return ast.restore() == expected and ast.restore() == expected
+
+    # assigning a field invalidates the node on its own, also for a node
+    # built by hand and edited after it was attached
+    replacement = NumberEntity("0")
+    pair.data = replacement
+    if not restores_to(head + "0" + tail):
+        return False
+    replacement.raw = "1"
+    if not restores_to(head + "1" + tail):
+        return False
+    pair.data = original
+    if not restores_to(input_data):
+        return False
+
+    # parsed nodes only again, so the rebuilt ancestors may now be cached
+    key = pair.key
+    pair.key = key + "_"
+    key_end = pair.start_pos + len(key)
+    if not restores_to(input_data[:key_end] + "_" + input_data[key_end:]):
+        return False
+    pair.key = key
+
+    # edits inside a Filler need an explicit invalidate()
+    filler = pair.postcolumn_filler
+    filler.text += " "
+    pair.invalidate()
+    if not restores_to(head + " " + input_data[original.start_pos :]):
+        return False
+    filler.text = filler.text[:-1]
+    pair.invalidate()
+    return restores_to(input_data)
+
+
+def check_number_values():
+    """NumberEntity.value gives a float only for a point or an exponent."""
+    for raw, expected in (("1e5", 1e5), ("1.", 1.0), (".5", 0.5), ("+3", 3)):
+        value = NumberEntity(raw).value
+        if type(value) is not type(expected) or value != expected:
+            return False
+    return True
+
+
+def fillers(node):
+    """Yield every Filler found below node."""
+    if isinstance(node, Filler):
+        yield node
+    elif isinstance(node, (list, tuple)):
+        for child in node:
+            yield from fillers(child)
+    elif is_dataclass(node):
+        for field in fields(node):
+            yield from fillers(getattr(node, field.name))
+
+
+def check_filler_parts(ast):
+    """Filler.parts() splits a filler into trivia that join back to it."""
+    sample = Filler(" \t// line\n/* block\n // inside */\r\n/**/")
+    for filler in (sample, *fillers(ast)):
+        if "".join(part.restore() for part in filler.parts()) != filler.text:
+            return False
+    return [type(part).__name__ for part in sample.parts()] == [
+        "Spacing",
+        "SinglelineComment",
+        "Spacing",
+        "MultilineComment",
+        "Spacing",
+        "MultilineComment",
+    ]
 
 
 def main():
@@ -41,8 +136,27 @@ def main():
             print(restored)
             # exit non-zero on mismatch
             sys.exit(2)
-        else:
-            print("Restore successful and identical to original.")
+
+        try:
+            reference = parse_configurik_lark(input_data)
+        except UnexpectedInput as e:
+            print("Parsers disagree: the LALR parser rejects this input!")
+            print(f"Line {e.line}, Column {e.column}:")
+            print(e.get_context(input_data))
+            sys.exit(3)
+        if reference != ast:
+            print("AST differs from the one produced by the LALR parser!")
+            sys.exit(3)
+        if not check_edits(ast, input_data):
+            print("Restore after editing the AST is wrong!")
+            sys.exit(4)
+        if not check_number_values():
+            print("NumberEntity.value picks the wrong type or value!")
+            sys.exit(5)
+        if not check_filler_parts(ast):
+            print("Filler.parts() doesn't split fillers back into their text!")
+            sys.exit(6)
+        print("Restore successful and identical to original.")
 
 
 if __name__ == "__main__":